@@ -0,0 +1,287 @@
+"""Headless batch runner for parameter sweeps.
+
+Usage: python3 batch.py SPEC.json [-o OUTPUT] [--engine ENGINE] [-j PROCESSES]
+
+The sweep spec is a JSON file, e.g.
+
+    {
+      "grid": {"INITIAL_SHOCK": {"linspace": [0, 0.3, 21]},
+               "PRICE_IMPACTS": [0.01, 0.05]},
+      "parameters": {"BANK_LEVERAGE_BUFFER": 1},
+      "replicas": 10,
+      "engine": "agent",
+      "seed": 1337,
+      "data": ["EBA_2018.csv", "EBA_2016.csv"],
+      "output": "sweep.npz",
+      "processes": 4
+    }
+
+`grid` is expanded as a cartesian product, in the order the keys are given.
+`parameters` are fixed overrides of `model.Parameters`. `data` is either one
+balance sheet file or a list of them, which is then an outer axis of the
+sweep. The output is an .npz file with the grid, the data files and the
+extent of systemic event / proportion of tradable assets sold for every
+(grid point, replica) pair, or every (data file, grid point, replica)
+triple when `data` is a list. With `processes` > 1, the initial state of
+every data file and the grid are placed once in shared memory (see
+sharedstate.py) and the tasks are run by a pool of workers.
+
+Only the simulation core is imported; plotting lives in plotting.py.
+"""
+import time
+_t0 = time.perf_counter()
+
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+import fixedpoint
+import sharedstate
+from contracts import ASSET_TYPES
+from model import Model, get_extent_of_systemic_event, load_balance_sheets
+
+IMPORT_TIME = time.perf_counter() - _t0
+
+
+def load_spec(path):
+    with open(path, 'r') as f:
+        spec = json.load(f)
+    if 'grid' not in spec:
+        raise ValueError('sweep spec must have a "grid"')
+    spec.setdefault('parameters', {})
+    spec.setdefault('replicas', 1)
+    spec.setdefault('engine', 'agent')
+    spec.setdefault('seed', 1337)
+    spec.setdefault('data', 'EBA_2018.csv')
+    spec.setdefault('output', 'sweep.npz')
+    spec.setdefault('processes', 1)
+    check_spec(spec)
+    return spec
+
+
+def check_spec(spec):
+    # Raises ValueError before any work (or any worker) is started.
+    for key in ('replicas', 'processes'):
+        if not isinstance(spec[key], int) or spec[key] < 1:
+            raise ValueError('%s must be an integer >= 1, got %r' % (key, spec[key]))
+    if spec['engine'] not in ENGINES:
+        raise ValueError('unknown engine: %s' % spec['engine'])
+    data = spec['data']
+    if not (isinstance(data, str) or
+            (isinstance(data, list) and data and
+             all(isinstance(path, str) for path in data))):
+        raise ValueError('data must be a path or a non-empty list of paths, '
+                         'got %r' % (data,))
+
+
+def datasets(spec):
+    # The data files of the sweep, as a list.
+    data = spec['data']
+    return [data] if isinstance(data, str) else list(data)
+
+
+def _expand_values(values):
+    if isinstance(values, dict):
+        start, stop, num = values['linspace']
+        return list(np.linspace(start, stop, int(num)))
+    if not isinstance(values, list):
+        return [values]
+    return values
+
+
+def expand_grid(spec):
+    # Returns the parameter names and the grid points, in the order of the
+    # cartesian product of the spec's grid.
+    names = list(spec['grid'])
+    axes = [_expand_values(spec['grid'][name]) for name in names]
+    points = [tuple(float(v) for v in p) for p in itertools.product(*axes)]
+    return names, points
+
+
+def make_tasks(spec):
+    # A task is a (data file index, grid point index, replica) triple. The
+    # task index is used to derive the seed of the task, so that a task gives
+    # the same result regardless of which process runs it.
+    _, points = expand_grid(spec)
+    return [(d, i, r) for d in range(len(datasets(spec)))
+            for i in range(len(points)) for r in range(spec['replicas'])]
+
+
+def set_parameter(parameters, name, value):
+    if not hasattr(parameters, name):
+        raise ValueError('unknown parameter: %s' % name)
+    if name == 'PRICE_IMPACTS':
+        value = defaultdict(lambda v=value: v)
+    elif name == 'ASSET_TO_SHOCK':
+        value = int(value)
+    setattr(parameters, name, value)
+
+
+def seed_task(seed, task_index):
+    random.seed(seed + task_index)
+    np.random.seed(seed + task_index)
+
+
+def run_agent_task(model):
+    model.initialize()
+    defaults, total_sold = model.run_simulation()
+    eoc = get_extent_of_systemic_event(defaults, len(model.allAgents))
+    return eoc, float(total_sold[-1])
+
+
+def run_fixedpoint_task(model):
+    # Same horizon as the agent engine, so that --engine does not change the
+    # answer.
+    result = fixedpoint.solve_model(
+        model, max_rounds=model.parameters.SIMULATION_TIMESTEPS)
+    eoc = get_extent_of_systemic_event(result.defaults[0], result.nbanks)
+    return eoc, float(result.total_sold[0, -1])
+
+
+ENGINES = {
+    'agent': run_agent_task,
+    'fixedpoint': run_fixedpoint_task,
+}
+
+
+def load_models(spec):
+    # One model per data file, with its initial state loaded once.
+    models = []
+    for path in datasets(spec):
+        model = Model(path)
+        model.initial_state = model.get_initial_state()
+        models.append(model)
+    return models
+
+
+def run_tasks(spec, tasks, models=None, points=None):
+    # Runs the given tasks and returns their (eoc, sold) outcomes, in the
+    # order of `tasks`. `models` has one model per data file.
+    if spec['engine'] not in ENGINES:
+        raise ValueError('unknown engine: %s' % spec['engine'])
+    run_task = ENGINES[spec['engine']]
+    if models is None:
+        models = load_models(spec)
+    if points is None:
+        _, points = expand_grid(spec)
+    names = list(spec['grid'])
+    nreplicas = spec['replicas']
+    out = []
+    for d, i, r in tasks:
+        model = models[d]
+        for name, value in spec['parameters'].items():
+            set_parameter(model.parameters, name, value)
+        for name, value in zip(names, points[i]):
+            set_parameter(model.parameters, name, float(value))
+        seed_task(spec['seed'], (d * len(points) + i) * nreplicas + r)
+        out.append(run_task(model))
+    return out
+
+
+def collect_results(spec, tasks, outs):
+    # Returns the eocs and solds arrays of the sweep from the outcomes of its
+    # tasks, with a leading data file axis when `data` is a list.
+    _, points = expand_grid(spec)
+    shape = (len(datasets(spec)), len(points), spec['replicas'])
+    eocs = np.zeros(shape)
+    solds = np.zeros(shape)
+    for (d, i, r), (eoc, sold) in zip(tasks, outs):
+        eocs[d, i, r] = eoc
+        solds[d, i, r] = sold
+    if isinstance(spec['data'], str):
+        return eocs[0], solds[0]
+    return eocs, solds
+
+
+# State of a worker process, set up once by _init_worker().
+_worker = {}
+
+
+def _init_worker(spec, directories):
+    # `directories` has the shared state of every data file, in order.
+    models = []
+    for path, directory in zip(datasets(spec), directories):
+        state = sharedstate.attach(directory)
+        model = Model(path)
+        model.initial_state = state.initial_state()
+        models.append(model)
+    _worker.update(spec=spec, models=models, points=state.grid)
+
+
+def _run_worker_task(task):
+    return run_tasks(_worker['spec'], [task], _worker['models'],
+                     _worker['points'])[0]
+
+
+def run_sweep(spec):
+    check_spec(spec)
+    names, points = expand_grid(spec)
+    tasks = make_tasks(spec)
+    prices = np.ones(len(ASSET_TYPES))
+    processes = spec['processes']
+    if processes > 1:
+        # The initial states and the grid are shared with the workers
+        # instead of being re-read or pickled by each of them.
+        with contextlib.ExitStack() as stack:
+            directories = []
+            for path in datasets(spec):
+                bank_names, balance_sheets = load_balance_sheets(path)
+                state = stack.enter_context(sharedstate.SharedInitialState(
+                    bank_names, balance_sheets, prices, points))
+                directories.append(state.directory)
+            with multiprocessing.Pool(processes, _init_worker,
+                                      (spec, directories)) as pool:
+                chunksize = max(1, len(tasks) // (4 * processes))
+                outs = pool.map(_run_worker_task, tasks, chunksize)
+    else:
+        outs = run_tasks(spec, tasks, load_models(spec), points)
+    eocs, solds = collect_results(spec, tasks, outs)
+    return names, np.array(points), eocs, solds
+
+
+def save_results(path, names, grid, eocs, solds, **extra):
+    np.savez(path, names=np.array(names), grid=grid, eocs=eocs, solds=solds,
+             **extra)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('spec', help='path to the JSON sweep spec')
+    parser.add_argument('-o', '--output', help='overrides the spec output path')
+    parser.add_argument('--engine', choices=sorted(ENGINES),
+                        help='overrides the spec engine')
+    parser.add_argument('-j', '--processes', type=int,
+                        help='overrides the spec number of processes')
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    if args.output:
+        spec['output'] = args.output
+    if args.engine:
+        spec['engine'] = args.engine
+    if args.processes:
+        spec['processes'] = args.processes
+
+    t_start = time.perf_counter()
+    names, grid, eocs, solds = run_sweep(spec)
+    run_time = time.perf_counter() - t_start
+    timings = dict(import_time=IMPORT_TIME, startup_time=t_start - _t0,
+                   run_time=run_time)
+    save_results(spec['output'], names, grid, eocs, solds,
+                 datasets=np.array(datasets(spec)), **timings)
+
+    print('import %.3fs, startup %.3fs, run %.3fs (%d tasks), matplotlib '
+          'loaded: %s' % (IMPORT_TIME, t_start - _t0, run_time, eocs.size,
+                          'matplotlib' in sys.modules),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
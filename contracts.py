@@ -95,6 +95,9 @@ class AssetType:
     CORPORATE_BONDS = 1
     GOV_BONDS = 2
 
+# All the tradable asset types, in the order used by array-based code.
+ASSET_TYPES = (AssetType.CORPORATE_BONDS, AssetType.GOV_BONDS)
+
 
 class Tradable(Contract):
     ctype = 'Tradable'
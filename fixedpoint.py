@@ -0,0 +1,234 @@
+import numpy as np
+
+from contracts import ASSET_TYPES, eps
+from model import HOLDINGS_COLUMNS, Model, get_extent_of_systemic_event
+
+# Array version of the simultaneous fire sale dynamics of
+# Model.run_simulation (Cont-Schaanning 2017). Instead of simulating the
+# banks one by one, every round is a map on arrays of shape
+# (scenarios x banks x assets), which is iterated until the system reaches a
+# fixed point, i.e. no bank is selling anymore. Independent scenarios are
+# solved together, in one pass.
+#
+# One round of the map mirrors the agent engine:
+# 1. step: banks that defaulted in the previous round put all of their
+#    tradable assets for sale (see Bank.trigger_default).
+# 2. the asset market is cleared with the exponential price impact, and the
+#    orders are settled at the mid-point price (see AssetMarket).
+# 3. act: banks below BANK_LEVERAGE_MIN default, the others delever to
+#    BANK_LEVERAGE_TARGET when below BANK_LEVERAGE_BUFFER, by paying off
+#    their loan with cash first and then selling tradable assets
+#    proportionally (see do_delever).
+
+
+class FixedPointResult:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _get_param(scenario, name):
+    if isinstance(scenario, dict):
+        return scenario[name]
+    return getattr(scenario, name)
+
+
+def scenario_arrays(scenarios):
+    # `scenarios` is a list of objects with the attributes of
+    # model.Parameters (e.g. model.Parameters itself), or of dicts with the
+    # same keys.
+    n = len(scenarios)
+    shock = np.zeros((n, len(ASSET_TYPES)))
+    beta = np.zeros((n, len(ASSET_TYPES)))
+    lev = np.zeros((n, 3))
+    for s, scenario in enumerate(scenarios):
+        if not _get_param(scenario, 'SIMULTANEOUS_FIRESALE'):
+            raise ValueError('the fixed-point solver requires SIMULTANEOUS_FIRESALE')
+        shocked = ASSET_TYPES.index(_get_param(scenario, 'ASSET_TO_SHOCK'))
+        shock[s, shocked] = _get_param(scenario, 'INITIAL_SHOCK')
+        price_impacts = _get_param(scenario, 'PRICE_IMPACTS')
+        for m, atype in enumerate(ASSET_TYPES):
+            pi = price_impacts if np.isscalar(price_impacts) else price_impacts[atype]
+            # Same `beta` as AssetMarket.compute_price_impact
+            beta[s, m] = -1 / 0.05 * np.log(1 - pi)
+        lev[s] = (_get_param(scenario, 'BANK_LEVERAGE_MIN'),
+                  _get_param(scenario, 'BANK_LEVERAGE_BUFFER'),
+                  _get_param(scenario, 'BANK_LEVERAGE_TARGET'))
+    return shock, beta, lev
+
+
+def _sell_proportionally(value, amount):
+    # perform_proportionally() for SellAsset actions. `value` is the
+    # (scenarios x banks x assets) value available for sale and `amount` the
+    # (scenarios x banks) amount to raise. Returns the amount to sell per
+    # asset.
+    maximum = value.sum(axis=2)
+    act = (maximum > 0) & (amount > 0)
+    amount = np.where(act, np.minimum(amount, maximum), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = value * (amount / maximum)[:, :, None]
+    return np.where(act[:, :, None], out, 0.0)
+
+
+def _round(st, beta, lev_min, lev_buffer, lev_target, other_asset,
+           other_liability, total):
+    # One round of the map, on the state `st` of the active scenarios.
+    q, p, cash, loan, for_sale = st['q'], st['p'], st['cash'], st['loan'], st['for_sale']
+
+    # 1. step: liquidate the banks that defaulted in the previous round
+    value = (q - for_sale) * p[:, None, :]
+    amount = np.where(st['to_liquidate'], value.sum(axis=2), 0.0)
+    sell = _sell_proportionally(value, amount)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        qty = np.where(p[:, None, :] > eps, sell / p[:, None, :], 0.0)
+    for_sale = for_sale + np.where(qty > eps, qty, 0.0)
+
+    # 2. clear the market
+    old_p = p
+    sold = for_sale.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction_sold = np.where(total > 0, sold / total, 0.0)
+    p = old_p * np.exp(-fraction_sold * beta)
+    settled = np.minimum(q, for_sale)
+    q = q - settled
+    value_sold = settled * ((p + old_p) / 2)[:, None, :]
+    cash = cash + np.where(value_sold >= eps, value_sold, 0.0).sum(axis=2)
+
+    # 3. act
+    A = cash + (q * p[:, None, :]).sum(axis=2) + other_asset
+    E = A - loan - other_liability
+    with np.errstate(invalid='ignore', divide='ignore'):
+        leverage = E / A
+    alive = st['alive']
+    defaulted = alive & (leverage < lev_min)
+    delevering = alive & ~defaulted & (leverage < lev_buffer)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        amount = np.where(
+            delevering, np.maximum(0, E / leverage - E / lev_target), 0.0)
+    # Pay off the loan with the available cash
+    paid = np.where((loan > 0) & (amount > 0),
+                    np.minimum(np.minimum(amount, cash), loan), 0.0)
+    paid = np.maximum(paid, 0.0)
+    loan = loan - paid
+    cash = cash - paid
+    amount = amount - paid
+    # Raise liquidity to delever in the next round
+    value = q * p[:, None, :]
+    sell = _sell_proportionally(value, np.where(cash < amount, amount - cash, 0.0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        qty = np.where(p[:, None, :] > eps, sell / p[:, None, :], 0.0)
+
+    return dict(q=q, p=p, cash=cash, loan=loan,
+                for_sale=np.where(qty > eps, qty, 0.0),
+                alive=alive & ~defaulted, to_liquidate=defaulted,
+                cumulative_sold=st['cumulative_sold'] + sold)
+
+
+def solve(balance_sheets, prices, scenarios, max_rounds=10000, tol=1e-12):
+    """Iterates the simultaneous fire sale map until no bank sells anymore.
+
+    A scenario is deemed converged once the quantity put for sale in a round
+    is at most `tol` of the market cap and there is no default left to be
+    liquidated. It is then frozen and dropped from the subsequent rounds,
+    which only run on the remaining scenarios. Stops after `max_rounds`
+    rounds; the scenarios that are still selling by then have
+    `converged` = False.
+    """
+    balance_sheets = np.asarray(balance_sheets, dtype=np.float64)
+    S = len(scenarios)
+    N = len(balance_sheets)
+    shock, beta, lev = scenario_arrays(scenarios)
+
+    p = np.repeat(np.asarray(prices, dtype=np.float64)[None, :], S, axis=0)
+    p *= 1.0 - shock
+    state = dict(
+        q=np.repeat(balance_sheets[None, :, HOLDINGS_COLUMNS], S, axis=0),
+        p=p,
+        cash=np.repeat(balance_sheets[None, :, 0], S, axis=0),
+        loan=np.repeat(balance_sheets[None, :, 4], S, axis=0),
+        for_sale=np.zeros((S, N, len(ASSET_TYPES))),
+        alive=np.ones((S, N), dtype=bool),
+        to_liquidate=np.zeros((S, N), dtype=bool),
+        cumulative_sold=np.zeros((S, len(ASSET_TYPES))))
+    other_asset = balance_sheets[None, :, 3]
+    other_liability = balance_sheets[None, :, 5]
+    total = balance_sheets[:, HOLDINGS_COLUMNS].sum(axis=0)
+
+    active = np.arange(S)
+    rounds = np.full(S, max_rounds)
+    converged = np.zeros(S, dtype=bool)
+    defaults = [np.zeros(S, dtype=int)]
+    total_sold = []
+
+    t = 0
+    while t < max_rounds and len(active):
+        t += 1
+        # Only the scenarios that have not converged yet are iterated.
+        st = {k: v[active] for k, v in state.items()}
+        st = _round(st, beta[active], lev[active, 0:1], lev[active, 1:2],
+                    lev[active, 2:3], other_asset, other_liability, total)
+        for k, v in st.items():
+            state[k][active] = v
+
+        round_defaults = np.zeros(S, dtype=int)
+        round_defaults[active] = st['to_liquidate'].sum(axis=1)
+        defaults.append(round_defaults)
+        total_sold.append(state['cumulative_sold'].sum(axis=1) / total.sum())
+
+        done = ~st['to_liquidate'].any(axis=1) & (
+            st['for_sale'].sum(axis=(1, 2)) <= tol * total.sum())
+        rounds[active[done]] = t
+        converged[active[done]] = True
+        # Frozen scenarios do not sell their residual orders.
+        state['for_sale'][active[done]] = 0.0
+        active = active[~done]
+
+    return FixedPointResult(
+        defaults=np.array(defaults).T,
+        total_sold=np.array(total_sold).T.reshape(S, t),
+        rounds=rounds,
+        converged=converged,
+        cash=state['cash'],
+        holdings=state['q'],
+        loan=state['loan'],
+        prices=state['p'],
+        alive=state['alive'],
+        nbanks=N)
+
+
+def solve_model(model, **kwargs):
+    # Solves a single scenario with the current parameters and initial
+    # state of `model`.
+    names, balance_sheets, prices = model.get_initial_state()
+    return solve(balance_sheets, prices, [model.parameters], **kwargs)
+
+
+def cross_validate(model=None):
+    """Runs the agent engine and the solver over SIMULATION_TIMESTEPS rounds
+    with the current parameters, and returns the maximum absolute
+    differences of the per-round default counts and proportion of tradable
+    assets sold, and of the extent of systemic event."""
+    if model is None:
+        model = Model()
+    model.initialize()
+    defaults, total_sold = model.run_simulation()
+    T = model.parameters.SIMULATION_TIMESTEPS
+    result = solve_model(model, max_rounds=T, tol=0.0)
+    fp_defaults = np.zeros(T + 1)
+    fp_defaults[:result.defaults.shape[1]] = result.defaults[0]
+    fp_total_sold = np.full(T, result.total_sold[0, -1] if T else 0.0)
+    fp_total_sold[:result.total_sold.shape[1]] = result.total_sold[0]
+    eoc = get_extent_of_systemic_event(defaults, len(model.allAgents))
+    fp_eoc = get_extent_of_systemic_event(fp_defaults, result.nbanks)
+    return dict(
+        defaults=np.abs(np.array(defaults) - fp_defaults).max(),
+        total_sold=np.abs(np.array(total_sold, dtype=np.float64) - fp_total_sold).max(),
+        eoc=abs(eoc - fp_eoc),
+        rounds=int(result.rounds[0]))
+
+
+if __name__ == '__main__':
+    diffs = cross_validate()
+    print('max abs difference with the agent engine: defaults %g, total sold '
+          '%g, eoc %g; rounds to convergence: %d' % (
+              diffs['defaults'], diffs['total_sold'], diffs['eoc'],
+              diffs['rounds']))
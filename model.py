@@ -1,20 +1,19 @@
 import random
 from collections import defaultdict
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 from economicsl import Simulation
 
 from institutions import Bank
 from markets import AssetMarket
-from contracts import AssetType
+from contracts import AssetType, ASSET_TYPES
 
 
 NBANKS = 48
-def get_extent_of_systemic_event(out):
+def get_extent_of_systemic_event(out, nbanks=NBANKS):
     # See Gai-Kapadia 2010
-    eose = sum(out) / NBANKS
+    eose = sum(out) / nbanks
     if eose < 0.05:
         return 0
     return eose
@@ -30,10 +29,46 @@ class Parameters:
     PRICE_IMPACTS = defaultdict(lambda: 0.05)
     SIMULTANEOUS_FIRESALE = True
 
+# The columns of the balance sheet array returned by load_balance_sheets().
+# The tradable columns (corp_bonds, gov_bonds) form the holdings matrix, in
+# the order of ASSET_TYPES.
+BALANCE_SHEET_COLUMNS = ('cash', 'corp_bonds', 'gov_bonds', 'other_asset',
+                         'loan', 'other_liability')
+HOLDINGS_COLUMNS = slice(1, 3)
+
+
+def load_balance_sheets(path):
+    # Returns the bank names and an (nbanks x 6) array of their initial
+    # balance sheets.
+    with open(path, 'r') as data:
+        bank_balancesheets = data.read().strip().split('\n')[1:]
+    names = []
+    balance_sheets = np.zeros((len(bank_balancesheets), len(BALANCE_SHEET_COLUMNS)))
+    for i, bs in enumerate(bank_balancesheets):
+        row = bs.split(' ')
+        bank_name, CET1E, leverage, debt_sec, gov_bonds = row
+        debt_sec = float(debt_sec)
+        gov_bonds = eval(gov_bonds)
+        CET1E = float(CET1E)
+        corp_bonds = debt_sec - gov_bonds
+        asset = CET1E / (float(leverage) / 100)
+        cash = 0.05 * asset
+        liability = asset - CET1E
+        other_asset = asset - debt_sec - cash
+        loan = other_liability = liability / 2
+        names.append(bank_name)
+        balance_sheets[i] = (cash, corp_bonds, gov_bonds, other_asset,
+                             loan, other_liability)
+    return names, balance_sheets
+
 # + {"slideshow": {"slide_type": "subslide"}}
 class Model:
-    def __init__(self):
+    def __init__(self, data_path='EBA_2018.csv'):
         self.simulation = None
+        self.data_path = data_path
+        # When set, this is a (names, balance_sheets, prices) tuple used
+        # instead of reading `data_path` (see sharedstate.py).
+        self.initial_state = None
         self.parameters = Parameters
 
     def get_time(self):
@@ -51,35 +86,38 @@ class Model:
         self.assetMarket.set_price(assetType, new_price)
         self.update_asset_price(assetType)
 
+    def get_initial_state(self):
+        if self.initial_state is not None:
+            return self.initial_state
+        names, balance_sheets = load_balance_sheets(self.data_path)
+        return names, balance_sheets, np.ones(len(ASSET_TYPES))
+
     def initialize(self):
         self.simulation = Simulation()
         self.allAgents = []
         self.assetMarket = AssetMarket(self)
-        with open('EBA_2018.csv', 'r') as data:
-            self.bank_balancesheets = data.read().strip().split('\n')[1:]
-        for bs in self.bank_balancesheets:
-            row = bs.split(' ')
-            bank_name, CET1E, leverage, debt_sec, gov_bonds = row
+        names, balance_sheets, prices = self.get_initial_state()
+        # The prices have to be set before the banks' tradable contracts
+        # are created, as they read the market price.
+        for atype, price in zip(ASSET_TYPES, np.asarray(prices).tolist()):
+            self.assetMarket.set_price(atype, price)
+        for bank_name, row in zip(names, np.asarray(balance_sheets)):
             bank = Bank(bank_name, self.simulation)
-            debt_sec = float(debt_sec)
-            gov_bonds = eval(gov_bonds)
-            CET1E = float(CET1E)
-            corp_bonds = debt_sec - gov_bonds
-            asset = CET1E / (float(leverage) / 100)
-            cash = 0.05 * asset
-            liability = asset - CET1E
-            other_asset = asset - debt_sec - cash
-            loan = other_liability = liability / 2
+            cash, corp_bonds, gov_bonds, other_asset, loan, other_liability = row.tolist()
             bank.initialize_balance_sheet(
                 self, self.assetMarket,
                 assets=(cash, corp_bonds, gov_bonds, other_asset),
                 liabilities=(loan, other_liability))
             self.allAgents.append(bank)
 
-    def run_simulation(self):
+    def run_simulation(self, recorder=None):
+        # `recorder` is an optional recorder.TrajectoryRecorder.
         self.apply_initial_shock(
             Parameters.ASSET_TO_SHOCK,
             Parameters.INITIAL_SHOCK)
+        if recorder is not None:
+            recorder.start(self)
+            recorder.record(self)
         defaults = [0]
         total_sold = []
         while self.get_time() < Parameters.SIMULATION_TIMESTEPS:
@@ -102,22 +140,11 @@ class Model:
             total_sold.append(
                 sum(self.assetMarket.cumulative_quantities_sold.values()) /
                 sum(self.assetMarket.total_quantities.values()))
+            if recorder is not None:
+                recorder.record(self)
         return defaults, total_sold
 
 # + {"slideshow": {"slide_type": "subslide"}}
-# Helper function
-def make_plots(eocs, solds, xarray, xlabel):
-    plt.figure()
-    plt.ylim(-0.01, 1.05)
-    plt.plot(xarray, eocs)
-    plt.xlabel(xlabel)
-    plt.ylabel('Systemic risk $\\mathbb{E}$')
-
-    plt.figure()
-    plt.plot(xarray, 100 * solds)
-    plt.xlabel(xlabel)
-    plt.ylabel('Proportion of tradable assets delevered (%)')
-
 def run_sim_set(model, params, apply_param):
     eocs = []
     total_solds = []
@@ -125,7 +152,7 @@ def run_sim_set(model, params, apply_param):
         apply_param(param)
         model.initialize()
         defaults, total_sold = model.run_simulation()
-        eoc = get_extent_of_systemic_event(defaults)
+        eoc = get_extent_of_systemic_event(defaults, len(model.allAgents))
         eocs.append(eoc)
         # Only use the final element of total_sold (i.e. at the
         # end of the simulation).
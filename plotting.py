@@ -0,0 +1,18 @@
+import matplotlib.pyplot as plt
+
+# Plotting is kept out of model.py so that headless runs (see batch.py) do
+# not have to import matplotlib.
+
+
+# Helper function
+def make_plots(eocs, solds, xarray, xlabel):
+    plt.figure()
+    plt.ylim(-0.01, 1.05)
+    plt.plot(xarray, eocs)
+    plt.xlabel(xlabel)
+    plt.ylabel('Systemic risk $\\mathbb{E}$')
+
+    plt.figure()
+    plt.plot(xarray, 100 * solds)
+    plt.xlabel(xlabel)
+    plt.ylabel('Proportion of tradable assets delevered (%)')
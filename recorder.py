@@ -0,0 +1,74 @@
+import numpy as np
+
+from contracts import AssetType, ASSET_TYPES, Tradable
+
+
+def _holding(assetType):
+    def get(bank):
+        return sum(a.quantity for a in bank.get_ledger().get_assets_of_type(Tradable)
+                   if a.get_asset_type() == assetType)
+    return get
+
+
+# Per-bank quantities that can be recorded, keyed by field name.
+BANK_FIELDS = {
+    'leverage': lambda bank: bank.leverageConstraint.get_leverage(),
+    'cash': lambda bank: bank.get_cash(),
+    'equity': lambda bank: bank.get_ledger().get_equity_valuation(),
+    'assets': lambda bank: bank.get_ledger().get_asset_valuation(),
+    'corp_bonds': _holding(AssetType.CORPORATE_BONDS),
+    'gov_bonds': _holding(AssetType.GOV_BONDS),
+    'alive': lambda bank: bank.alive,
+}
+
+
+class TrajectoryRecorder:
+    """Records bank-level state and asset prices over the rounds of
+    `Model.run_simulation` into preallocated arrays.
+
+    After a run, `data[k, i, j]` is field `fields[j]` of bank `names[i]` at
+    round `times[k]`, and `prices[k, m]` is the price of `ASSET_TYPES[m]`.
+    Round 0 is the state right after the initial shock. Only every
+    `every`-th round is recorded, so the arrays have
+    `SIMULATION_TIMESTEPS // every + 1` rows.
+    """
+    def __init__(self, fields=tuple(BANK_FIELDS), every=1, dtype=np.float64):
+        unknown = set(fields) - set(BANK_FIELDS)
+        if unknown:
+            raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        self.fields = tuple(fields)
+        self.getters = [BANK_FIELDS[f] for f in self.fields]
+        self.every = every
+        self.dtype = dtype
+
+    def start(self, model):
+        # allAgents is shuffled every round, so the bank order is fixed here.
+        self.banks = list(model.allAgents)
+        self.names = [bank.get_name() for bank in self.banks]
+        nrows = int(model.parameters.SIMULATION_TIMESTEPS // self.every) + 1
+        self.data = np.full((nrows, len(self.banks), len(self.fields)),
+                            np.nan, dtype=self.dtype)
+        self.prices = np.full((nrows, len(ASSET_TYPES)), np.nan,
+                              dtype=self.dtype)
+        self.times = np.full(nrows, -1, dtype=int)
+        self.nrecorded = 0
+
+    def record(self, model):
+        t = model.get_time()
+        if t % self.every or self.nrecorded >= len(self.times):
+            return
+        k = self.nrecorded
+        row = self.data[k]
+        for i, bank in enumerate(self.banks):
+            for j, get in enumerate(self.getters):
+                row[i, j] = get(bank)
+        for m, atype in enumerate(ASSET_TYPES):
+            self.prices[k, m] = model.assetMarket.get_price(atype)
+        self.times[k] = t
+        self.nrecorded += 1
+
+    def field(self, name):
+        # Returns the (rounds x banks) array of a single field.
+        return self.data[:self.nrecorded, :, self.fields.index(name)]
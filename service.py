@@ -0,0 +1,273 @@
+"""Local stress test service.
+
+Usage: python3 service.py [--host 127.0.0.1] [--port 8765] [--window 0.01]
+
+Clients connect over TCP and send one JSON scenario per line, e.g.
+
+    {"id": 1, "INITIAL_SHOCK": 0.2, "PRICE_IMPACTS": 0.05,
+     "BANK_LEVERAGE_BUFFER": 0.04}
+
+Any parameter of `model.Parameters` that the fixed-point solver uses can be
+given, including SIMULATION_TIMESTEPS; the others take their default value.
+As with Model.run_simulation and batch.py, a scenario is run over
+SIMULATION_TIMESTEPS rounds, so the answers match theirs; a large
+SIMULATION_TIMESTEPS gives the terminal state of the cascade. The results
+are streamed back, one JSON line per scenario as soon as it is solved (not
+necessarily in the order of the requests):
+
+    {"id": 1, "eoc": 0.27, "total_sold": 0.08, "rounds": 5,
+     "converged": true, "cached": false}
+
+The line {"stats": true} returns the service's counters instead.
+
+Scenarios arriving within `window` seconds of each other are solved
+together in one batched run of fixedpoint.solve, and repeated scenarios are
+answered from a cache. `max_rounds` is a safety cap on the rounds of a
+batch, so that a scenario with a huge SIMULATION_TIMESTEPS that converges
+slowly does not hold up the others. Such a scenario is returned with
+"converged": false. Otherwise, "converged" tells whether the cascade has
+stopped within SIMULATION_TIMESTEPS rounds.
+"""
+import argparse
+import asyncio
+import json
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+import fixedpoint
+from contracts import ASSET_TYPES
+from model import Parameters, get_extent_of_systemic_event, load_balance_sheets
+
+# The parameters that can be set per scenario.
+SCENARIO_PARAMETERS = ('ASSET_TO_SHOCK', 'INITIAL_SHOCK', 'PRICE_IMPACTS',
+                       'BANK_LEVERAGE_MIN', 'BANK_LEVERAGE_BUFFER',
+                       'BANK_LEVERAGE_TARGET', 'SIMULATION_TIMESTEPS')
+
+
+def make_scenario(request):
+    # Returns the scenario of a request as a hashable tuple of the values of
+    # SCENARIO_PARAMETERS.
+    unknown = set(request) - set(SCENARIO_PARAMETERS) - {'id'}
+    if unknown:
+        raise ValueError('unknown parameters: %s' % ', '.join(sorted(unknown)))
+    defaults = dict(
+        ASSET_TO_SHOCK=Parameters.ASSET_TO_SHOCK,
+        INITIAL_SHOCK=Parameters.INITIAL_SHOCK,
+        PRICE_IMPACTS=Parameters.PRICE_IMPACTS[Parameters.ASSET_TO_SHOCK],
+        BANK_LEVERAGE_MIN=Parameters.BANK_LEVERAGE_MIN,
+        BANK_LEVERAGE_BUFFER=Parameters.BANK_LEVERAGE_BUFFER,
+        BANK_LEVERAGE_TARGET=Parameters.BANK_LEVERAGE_TARGET,
+        SIMULATION_TIMESTEPS=Parameters.SIMULATION_TIMESTEPS)
+    defaults.update(request)
+    scenario = tuple(float(defaults[name]) for name in SCENARIO_PARAMETERS)
+    params = dict(zip(SCENARIO_PARAMETERS, scenario))
+    if params['ASSET_TO_SHOCK'] not in ASSET_TYPES:
+        raise ValueError('unknown asset type: %s' % params['ASSET_TO_SHOCK'])
+    # The negated comparisons also reject NaN.
+    if not 0 <= params['PRICE_IMPACTS'] < 1:
+        raise ValueError('PRICE_IMPACTS must be in [0, 1)')
+    if not 0 <= params['INITIAL_SHOCK'] <= 1:
+        raise ValueError('INITIAL_SHOCK must be in [0, 1]')
+    if not 0 < params['BANK_LEVERAGE_MIN'] <= params['BANK_LEVERAGE_TARGET']:
+        raise ValueError('0 < BANK_LEVERAGE_MIN <= BANK_LEVERAGE_TARGET must hold')
+    if not params['BANK_LEVERAGE_BUFFER'] >= 0:
+        raise ValueError('BANK_LEVERAGE_BUFFER must be non-negative')
+    timesteps = params['SIMULATION_TIMESTEPS']
+    if not (1 <= timesteps < np.inf and timesteps == int(timesteps)):
+        raise ValueError('SIMULATION_TIMESTEPS must be an integer >= 1')
+    return scenario
+
+
+def _as_parameters(scenario):
+    params = dict(zip(SCENARIO_PARAMETERS, scenario))
+    params['ASSET_TO_SHOCK'] = int(params['ASSET_TO_SHOCK'])
+    params['SIMULATION_TIMESTEPS'] = int(params['SIMULATION_TIMESTEPS'])
+    params['SIMULTANEOUS_FIRESALE'] = True
+    return params
+
+
+class StressTestService:
+    def __init__(self, balance_sheets, prices, window=0.01, max_batch=1024,
+                 cache_size=100000, max_rounds=500):
+        self.balance_sheets = balance_sheets
+        self.prices = prices
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.max_rounds = max_rounds
+        self.cache = OrderedDict()
+        # Futures of the scenarios that are queued or being solved, so that
+        # concurrent requests for the same scenario share one solve.
+        self.pending = {}
+        self.queue = asyncio.Queue()
+        self.stats = dict(requests=0, cache_hits=0, batches=0, solved=0)
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.ensure_future(self._run_batches())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        # Otherwise, the clients waiting for a queued or running batch would
+        # wait forever.
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError('the service has stopped'))
+        self.pending.clear()
+
+    async def submit(self, scenario):
+        # Returns (result, cached).
+        self.stats['requests'] += 1
+        if scenario in self.cache:
+            self.cache.move_to_end(scenario)
+            self.stats['cache_hits'] += 1
+            return self.cache[scenario], True
+        future = self.pending.get(scenario)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[scenario] = future
+            self.queue.put_nowait(scenario)
+        return await asyncio.shield(future), False
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await loop.run_in_executor(None, self.solve, batch)
+            except Exception as e:
+                for scenario in batch:
+                    self.pending.pop(scenario).set_exception(e)
+                continue
+            self.stats['batches'] += 1
+            self.stats['solved'] += len(batch)
+            for scenario, result in zip(batch, results):
+                self.cache[scenario] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                self.pending.pop(scenario).set_result(result)
+
+    def solve(self, batch):
+        # The scenarios are solved together, in one run per horizon.
+        params = [_as_parameters(s) for s in batch]
+        by_horizon = defaultdict(list)
+        for i, p in enumerate(params):
+            by_horizon[p['SIMULATION_TIMESTEPS']].append(i)
+        results = [None] * len(batch)
+        for horizon, indices in by_horizon.items():
+            result = fixedpoint.solve(
+                self.balance_sheets, self.prices, [params[i] for i in indices],
+                max_rounds=min(horizon, self.max_rounds))
+            for s, i in enumerate(indices):
+                results[i] = dict(
+                    eoc=float(get_extent_of_systemic_event(result.defaults[s], result.nbanks)),
+                    total_sold=float(result.total_sold[s, -1]),
+                    rounds=int(result.rounds[s]),
+                    converged=bool(result.converged[s]))
+        return results
+
+    async def handle_request(self, line):
+        request = {}
+        try:
+            request = json.loads(line)
+            if request.get('stats'):
+                return dict(self.stats)
+            result, cached = await self.submit(make_scenario(request))
+            return dict(result, id=request.get('id'), cached=cached)
+        except Exception as e:
+            request_id = request.get('id') if isinstance(request, dict) else None
+            return dict(id=request_id, error=str(e))
+
+    async def handle_connection(self, reader, writer):
+        async def respond(line):
+            response = await self.handle_request(line)
+            try:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+            except ConnectionError:
+                # The client has gone away.
+                writer.close()
+
+        tasks = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    tasks.append(asyncio.ensure_future(respond(line)))
+        except ConnectionError:
+            pass
+        finally:
+            await asyncio.gather(*tasks)
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, data='EBA_2018.csv', **kwargs):
+    _, balance_sheets = load_balance_sheets(data)
+    service = StressTestService(balance_sheets, np.ones(len(ASSET_TYPES)), **kwargs)
+    service.start()
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    return service, server
+
+
+async def query(requests, host='127.0.0.1', port=8765):
+    # Client helper: sends the requests on one connection and returns the
+    # responses, in the order in which they arrive.
+    reader, writer = await asyncio.open_connection(host, port)
+    for request in requests:
+        writer.write((json.dumps(request) + '\n').encode())
+    await writer.drain()
+    writer.write_eof()
+    responses = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        responses.append(json.loads(line))
+    writer.close()
+    return responses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data', default='EBA_2018.csv')
+    parser.add_argument('--window', type=float, default=0.01,
+                        help='seconds during which requests are batched')
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-rounds', type=int, default=500,
+                        help='safety cap on the rounds of a batch')
+    args = parser.parse_args(argv)
+
+    async def run():
+        service, server = await serve(args.host, args.port, args.data,
+                                      window=args.window,
+                                      max_batch=args.max_batch,
+                                      max_rounds=args.max_rounds)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""Sharded sweep execution through a shared directory.
+
+Usage:
+    python3 shards.py plan SPEC.json DIR -n NSHARDS
+    python3 shards.py work DIR [--lease SECONDS] [--wait]
+    python3 shards.py merge DIR [-o OUTPUT]
+
+`plan` copies the sweep spec (see batch.py) into DIR, which has to be empty
+and visible to all the nodes, and splits its tasks into NSHARDS contiguous
+shards in task order (data file, grid point, replica). Any number of `work`
+processes, on any node, then claim shards by atomically creating
+DIR/shard-K.lock, run them, and write DIR/shard-K.npz. A worker that fails
+releases its lock; the lock of a worker that died is considered stale, and
+may be claimed again, once it has not been refreshed for `lease` seconds. A
+worker only refreshes and removes a lock that it still owns. `merge`
+reassembles the shard results into the same output as a single-node
+`batch.py` run, after checking that every shard was run with the planned
+spec and tasks.
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+import batch
+
+SPEC_FILE = 'spec.json'
+
+
+def _check_nshards(nshards):
+    if not isinstance(nshards, int) or nshards < 1:
+        raise ValueError('the number of shards must be at least 1, got %r' % nshards)
+
+
+def plan(spec, directory, nshards):
+    _check_nshards(nshards)
+    os.makedirs(directory, exist_ok=True)
+    # Results of a previous plan would otherwise be merged as if they
+    # belonged to this one.
+    if os.listdir(directory):
+        raise ValueError('%s is not empty' % directory)
+    spec = dict(spec, shards=nshards)
+    with open(os.path.join(directory, SPEC_FILE), 'w') as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def load_plan(directory):
+    spec = batch.load_spec(os.path.join(directory, SPEC_FILE))
+    if 'shards' not in spec:
+        raise ValueError('%s is not a sharded sweep directory' % directory)
+    _check_nshards(spec['shards'])
+    return spec
+
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+def shard_tasks(spec, k):
+    tasks = batch.make_tasks(spec)
+    n = spec['shards']
+    return tasks[k * len(tasks) // n:(k + 1) * len(tasks) // n]
+
+
+def _result_path(directory, k):
+    return os.path.join(directory, 'shard-%d.npz' % k)
+
+
+def _lock_path(directory, k):
+    return os.path.join(directory, 'shard-%d.lock' % k)
+
+
+def _lock_owner(lock):
+    # Returns the worker that holds the lock, or None.
+    try:
+        with open(lock) as f:
+            return json.load(f)['worker']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def claim(directory, k, worker_id, lease):
+    # Returns whether the shard has been claimed by this worker.
+    lock = _lock_path(directory, k)
+    try:
+        if time.time() - os.path.getmtime(lock) > lease:
+            # Stale lock: only one of the workers racing for it succeeds in
+            # moving it away.
+            stale = '%s.stale.%s' % (lock, worker_id)
+            os.rename(lock, stale)
+            if time.time() - os.path.getmtime(stale) <= lease:
+                # Another worker has claimed the shard in the meantime; give
+                # its lock back, unless yet another lock has been created.
+                try:
+                    os.link(stale, lock)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+    except FileNotFoundError:
+        pass
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        json.dump(dict(worker=worker_id, time=time.time()), f)
+    # The shard may have been finished while its lock was being released.
+    if os.path.exists(_result_path(directory, k)):
+        release(directory, k, worker_id)
+        return False
+    return True
+
+
+def release(directory, k, worker_id):
+    # Removes the lock of the shard if this worker still holds it: it may
+    # have been considered stale and claimed by another worker meanwhile.
+    lock = _lock_path(directory, k)
+    # As in claim(), the lock is moved away before being checked, so that a
+    # lock created in the meantime is not removed.
+    mine = '%s.release.%s' % (lock, worker_id)
+    try:
+        os.rename(lock, mine)
+    except FileNotFoundError:
+        return
+    if _lock_owner(mine) != worker_id:
+        try:
+            os.link(mine, lock)
+        except FileExistsError:
+            pass
+    os.remove(mine)
+
+
+def run_shard(spec, directory, k, models, worker_id):
+    lock = _lock_path(directory, k)
+    _, points = batch.expand_grid(spec)
+    tasks = shard_tasks(spec, k)
+    outs = []
+    for task in tasks:
+        outs.append(batch.run_tasks(spec, [task], models, points)[0])
+        # Heartbeat, so that the lock does not become stale. A lock that has
+        # been claimed again by another worker is left alone; both runs
+        # write the same result.
+        try:
+            if _lock_owner(lock) == worker_id:
+                os.utime(lock)
+        except FileNotFoundError:
+            pass
+    result = _result_path(directory, k)
+    tmp = '%s.tmp.%s' % (result, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.savez(f, tasks=np.array(tasks).reshape(-1, 3),
+                 outs=np.array(outs, dtype=np.float64).reshape(-1, 2),
+                 spec_hash=spec_hash(spec))
+    os.replace(tmp, result)
+
+
+def work(directory, lease=600, wait=False, poll=5):
+    # Runs shards until they are all done, and returns the number of shards
+    # run by this worker. Without `wait`, stops as soon as no shard can be
+    # claimed.
+    spec = load_plan(directory)
+    worker_id = '%s-%d' % (socket.gethostname(), os.getpid())
+    models = batch.load_models(spec)
+    nrun = 0
+    while True:
+        todo = [k for k in range(spec['shards'])
+                if not os.path.exists(_result_path(directory, k))]
+        if not todo:
+            return nrun
+        claimed = False
+        for k in todo:
+            if not claim(directory, k, worker_id, lease):
+                continue
+            claimed = True
+            try:
+                run_shard(spec, directory, k, models, worker_id)
+            finally:
+                release(directory, k, worker_id)
+            nrun += 1
+        if not claimed:
+            if not wait:
+                return nrun
+            time.sleep(poll)
+
+
+def merge(directory, spec=None):
+    # Returns the same (names, grid, eocs, solds) as batch.run_sweep.
+    if spec is None:
+        spec = load_plan(directory)
+    names, points = batch.expand_grid(spec)
+    missing = [k for k in range(spec['shards'])
+               if not os.path.exists(_result_path(directory, k))]
+    if missing:
+        raise ValueError('unfinished shards: %s' % ', '.join(map(str, missing)))
+    expected_hash = spec_hash(spec)
+    tasks, outs = [], []
+    for k in range(spec['shards']):
+        with np.load(_result_path(directory, k)) as shard:
+            if str(shard['spec_hash']) != expected_hash:
+                raise ValueError('shard %d was run with another spec' % k)
+            planned = np.array(shard_tasks(spec, k)).reshape(-1, 3)
+            if not np.array_equal(shard['tasks'], planned):
+                raise ValueError('shard %d does not have the planned tasks' % k)
+            tasks.extend(shard['tasks'])
+            outs.extend(shard['outs'])
+    eocs, solds = batch.collect_results(spec, tasks, outs)
+    return names, np.array(points), eocs, solds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('plan', help='split a sweep spec into shards')
+    p.add_argument('spec')
+    p.add_argument('directory')
+    p.add_argument('-n', '--shards', type=int, required=True)
+    p = subparsers.add_parser('work', help='claim and run shards')
+    p.add_argument('directory')
+    p.add_argument('--lease', type=float, default=600,
+                   help='seconds after which a lock is considered stale')
+    p.add_argument('--wait', action='store_true',
+                   help='wait for the shards locked by other workers')
+    p = subparsers.add_parser('merge', help='reassemble the shard results')
+    p.add_argument('directory')
+    p.add_argument('-o', '--output', help='overrides the spec output path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'plan':
+        spec = plan(batch.load_spec(args.spec), args.directory, args.shards)
+        print('%d tasks in %d shards' % (len(batch.make_tasks(spec)),
+                                         args.shards), file=sys.stderr)
+    elif args.command == 'work':
+        nrun = work(args.directory, args.lease, args.wait)
+        print('ran %d shards' % nrun, file=sys.stderr)
+    else:
+        spec = load_plan(args.directory)
+        names, grid, eocs, solds = merge(args.directory, spec)
+        batch.save_results(args.output or spec['output'], names, grid, eocs,
+                           solds, datasets=np.array(batch.datasets(spec)))
+
+
+if __name__ == '__main__':
+    main()
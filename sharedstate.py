@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# The initial system state (balance sheets, holdings, prices) and the
+# parameter grid of a sweep are written once as .npy files into a directory
+# (on /dev/shm when available, i.e. in shared memory). Worker processes
+# memory-map them read-only, so the data is neither copied nor pickled per
+# worker; each worker only builds its own mutable `Bank` objects from it.
+
+ARRAYS = ('balance_sheets', 'prices', 'grid')
+
+
+class SharedInitialState:
+    def __init__(self, names, balance_sheets, prices, grid, directory=None):
+        if directory is None:
+            base = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            directory = tempfile.mkdtemp(prefix='firesale-', dir=base)
+        self.directory = directory
+        arrays = dict(balance_sheets=balance_sheets, prices=prices, grid=grid)
+        for name in ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'),
+                    np.ascontiguousarray(arrays[name], dtype=np.float64))
+        with open(os.path.join(directory, 'names.json'), 'w') as f:
+            json.dump(list(names), f)
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AttachedState:
+    # Read-only, zero-copy view of a SharedInitialState, built from its
+    # directory.
+    def __init__(self, directory):
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'),
+                                        mmap_mode='r'))
+        with open(os.path.join(directory, 'names.json'), 'r') as f:
+            self.names = json.load(f)
+
+    def initial_state(self):
+        # The value to be assigned to `Model.initial_state`.
+        return self.names, self.balance_sheets, self.prices
+
+
+def attach(directory):
+    return AttachedState(directory)
@@ -29,7 +29,8 @@ from collections import defaultdict
 import matplotlib.pyplot as plt
 import numpy as np
 
-from model import Model, make_plots, run_sim_set
+from model import Model, run_sim_set
+from plotting import make_plots
 
 plt.ion()
 plt.rcParams['figure.figsize'] = (7.0, 4.8)
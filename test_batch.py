@@ -0,0 +1,114 @@
+import glob
+import json
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+pytest.importorskip('economicsl')
+
+import batch  # noqa: E402
+import sharedstate  # noqa: E402
+from model import Model  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SPEC = {
+    'grid': {'INITIAL_SHOCK': {'linspace': [0, 0.3, 4]},
+             'PRICE_IMPACTS': [0.01, 0.05]},
+    'replicas': 2,
+    'data': os.path.join(HERE, 'EBA_2018.csv'),
+}
+
+
+def write_data(tmp_path, nbanks=20):
+    # A second data file, with the first banks of EBA_2018.csv.
+    with open(SPEC['data']) as f:
+        lines = f.read().strip().split('\n')
+    path = tmp_path / 'first_banks.csv'
+    path.write_text('\n'.join(lines[:nbanks + 1]))
+    return str(path)
+
+
+def write_spec(tmp_path, **kwargs):
+    path = tmp_path / 'spec.json'
+    path.write_text(json.dumps(dict(SPEC, **kwargs)))
+    return str(path)
+
+
+@pytest.mark.parametrize('bad', [
+    dict(replicas=0), dict(replicas=1.5), dict(processes=0),
+    dict(processes=-2), dict(engine='nope'), dict(data=[]), dict(data=1)])
+def test_load_spec_validation(tmp_path, bad):
+    with pytest.raises(ValueError):
+        batch.load_spec(write_spec(tmp_path, **bad))
+
+
+def test_run_sweep_validation(tmp_path):
+    spec = batch.load_spec(write_spec(tmp_path))
+    spec['engine'] = 'nope'
+    with pytest.raises(ValueError):
+        batch.run_sweep(spec)
+
+
+def shared_dirs():
+    return set(glob.glob('/dev/shm/firesale-*') +
+               glob.glob(os.path.join(tempfile.gettempdir(), 'firesale-*')))
+
+
+@pytest.mark.parametrize('engine', ['agent', 'fixedpoint'])
+def test_processes_match_sequential(tmp_path, engine):
+    spec = batch.load_spec(write_spec(tmp_path, engine=engine))
+    before = shared_dirs()
+    sequential = batch.run_sweep(spec)
+    parallel = batch.run_sweep(dict(spec, processes=2))
+    assert parallel[0] == sequential[0]
+    for a, b in zip(parallel[1:], sequential[1:]):
+        np.testing.assert_array_equal(a, b)
+    # The shared state is removed once the sweep is done.
+    assert shared_dirs() == before
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_datasets_axis(tmp_path, processes):
+    data = [SPEC['data'], write_data(tmp_path)]
+    spec = batch.load_spec(write_spec(tmp_path, data=data, engine='fixedpoint',
+                                      processes=processes))
+    names, grid, eocs, solds = batch.run_sweep(spec)
+    assert eocs.shape == solds.shape == (2, len(grid), spec['replicas'])
+    # The first data file gives the same results as a sweep of it alone.
+    alone = batch.run_sweep(dict(spec, data=data[0]))
+    np.testing.assert_array_equal(eocs[0], alone[2])
+    np.testing.assert_array_equal(solds[0], alone[3])
+    assert not np.array_equal(solds[0], solds[1])
+
+
+def test_worker_state_is_read_only(tmp_path):
+    spec = batch.load_spec(write_spec(tmp_path))
+    names, points = batch.expand_grid(spec)
+    bank_names, balance_sheets = Model(spec['data']).get_initial_state()[:2]
+    with sharedstate.SharedInitialState(
+            bank_names, balance_sheets, np.ones(2), points) as state:
+        attached = sharedstate.attach(state.directory)
+        for name in sharedstate.ARRAYS:
+            assert not getattr(attached, name).flags.writeable
+        np.testing.assert_array_equal(attached.balance_sheets, balance_sheets)
+        assert attached.names == bank_names
+
+        batch._init_worker(spec, [state.directory])
+        model, = batch._worker['models']
+        assert not model.initial_state[1].flags.writeable
+        # The worker builds its mutable banks from the mapped arrays.
+        model.initialize()
+        assert len(model.allAgents) == len(bank_names)
+        directory = state.directory
+    assert not os.path.exists(directory)
+
+
+def test_initial_state_with_sequences():
+    model = Model(SPEC['data'])
+    names, balance_sheets, prices = model.get_initial_state()
+    model.initial_state = (names, balance_sheets.tolist(), [1.0, 1.0])
+    model.initialize()
+    assert len(model.allAgents) == len(names)
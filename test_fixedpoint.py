@@ -0,0 +1,70 @@
+import itertools
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+pytest.importorskip('economicsl')
+
+import fixedpoint  # noqa: E402
+from contracts import AssetType  # noqa: E402
+from model import Model, Parameters  # noqa: E402
+
+SHOCKS = [0, 0.1, 0.3]
+PRICE_IMPACTS = [0.01, 0.05]
+# Threshold model, buffer == target, and leverage targeting.
+BUFFERS = [0.04, 0.05, 1]
+ASSETS = [AssetType.CORPORATE_BONDS, AssetType.GOV_BONDS]
+GRID = list(itertools.product(SHOCKS, PRICE_IMPACTS, BUFFERS, ASSETS))
+
+
+@pytest.fixture
+def parameters():
+    saved = dict(vars(Parameters))
+    yield Parameters
+    for name in ('INITIAL_SHOCK', 'PRICE_IMPACTS', 'BANK_LEVERAGE_BUFFER',
+                 'ASSET_TO_SHOCK', 'SIMULATION_TIMESTEPS'):
+        setattr(Parameters, name, saved[name])
+
+
+def set_scenario(parameters, shock, pi, buffer, asset):
+    parameters.INITIAL_SHOCK = shock
+    parameters.PRICE_IMPACTS = defaultdict(lambda: pi)
+    parameters.BANK_LEVERAGE_BUFFER = buffer
+    parameters.ASSET_TO_SHOCK = asset
+
+
+@pytest.mark.parametrize('shock,pi,buffer,asset', GRID)
+@pytest.mark.parametrize('T', [6, 30])
+def test_cross_validate(parameters, shock, pi, buffer, asset, T):
+    set_scenario(parameters, shock, pi, buffer, asset)
+    parameters.SIMULATION_TIMESTEPS = T
+    diffs = fixedpoint.cross_validate(Model())
+    assert diffs['defaults'] == 0
+    assert diffs['total_sold'] < 1e-9
+    assert diffs['eoc'] < 1e-9
+
+
+@pytest.mark.parametrize('shock,pi,buffer,asset', GRID)
+def test_converges(parameters, shock, pi, buffer, asset):
+    set_scenario(parameters, shock, pi, buffer, asset)
+    result = fixedpoint.solve_model(Model())
+    assert result.converged[0]
+    assert result.rounds[0] < 10000
+
+
+def test_batched_equals_single(parameters):
+    model = Model()
+    names, balance_sheets, prices = model.get_initial_state()
+    scenarios = []
+    for shock, pi, buffer, asset in GRID:
+        set_scenario(parameters, shock, pi, buffer, asset)
+        scenarios.append(dict(vars(parameters)))
+    batched = fixedpoint.solve(balance_sheets, prices, scenarios)
+    for s, scenario in enumerate(scenarios):
+        single = fixedpoint.solve(balance_sheets, prices, [scenario])
+        assert batched.rounds[s] == single.rounds[0]
+        np.testing.assert_array_equal(
+            batched.total_sold[s, :single.total_sold.shape[1]],
+            single.total_sold[0])
+        np.testing.assert_array_equal(batched.prices[s], single.prices[0])
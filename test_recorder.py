@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('economicsl')
+
+from contracts import ASSET_TYPES  # noqa: E402
+from model import Model, Parameters  # noqa: E402
+from recorder import BANK_FIELDS, TrajectoryRecorder  # noqa: E402
+
+
+@pytest.fixture
+def timesteps():
+    saved = Parameters.SIMULATION_TIMESTEPS
+    yield
+    Parameters.SIMULATION_TIMESTEPS = saved
+
+
+def run(recorder):
+    model = Model()
+    model.initialize()
+    model.run_simulation(recorder)
+    return model
+
+
+@pytest.mark.parametrize('every', [1, 2, 4, 7])
+def test_shape(timesteps, every):
+    Parameters.SIMULATION_TIMESTEPS = 6
+    recorder = TrajectoryRecorder(every=every)
+    model = run(recorder)
+    nrows = 6 // every + 1
+    assert recorder.data.shape == (nrows, len(model.allAgents), len(BANK_FIELDS))
+    assert recorder.prices.shape == (nrows, len(ASSET_TYPES))
+    assert recorder.nrecorded == nrows
+    assert not np.isnan(recorder.data).any()
+
+
+def test_decimation(timesteps):
+    Parameters.SIMULATION_TIMESTEPS = 6
+    recorder = TrajectoryRecorder(fields=('cash',), every=4)
+    run(recorder)
+    assert list(recorder.times) == [0, 4]
+    assert recorder.field('cash').shape[0] == 2
+
+
+def test_float_timesteps(timesteps):
+    # As set by batch.set_parameter when SIMULATION_TIMESTEPS is a grid axis.
+    Parameters.SIMULATION_TIMESTEPS = 6.0
+    recorder = TrajectoryRecorder(every=4)
+    run(recorder)
+    assert list(recorder.times) == [0, 4]
+
+
+def test_values(timesteps):
+    Parameters.SIMULATION_TIMESTEPS = 6
+    model = Model()
+    model.initialize()
+    recorder = TrajectoryRecorder(fields=('leverage', 'gov_bonds'))
+    # Round 0 is recorded right after the initial shock.
+    model.apply_initial_shock(Parameters.ASSET_TO_SHOCK, Parameters.INITIAL_SHOCK)
+    leverage = [bank.leverageConstraint.get_leverage() for bank in model.allAgents]
+    model.initialize()
+    model.run_simulation(recorder)
+    np.testing.assert_allclose(recorder.field('leverage')[0], leverage)
+    for m, atype in enumerate(ASSET_TYPES):
+        # The market may hold its prices in extended precision.
+        assert recorder.prices[-1, m] == np.float64(model.assetMarket.get_price(atype))
+    # The last row is the final state of the banks, in the recorded order.
+    for i, bank in enumerate(recorder.banks):
+        assert recorder.field('leverage')[-1, i] == np.float64(
+            bank.leverageConstraint.get_leverage())
+
+
+@pytest.mark.parametrize('kwargs', [dict(fields=('nope',)), dict(every=0)])
+def test_invalid(kwargs):
+    with pytest.raises(ValueError):
+        TrajectoryRecorder(**kwargs)
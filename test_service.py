@@ -0,0 +1,144 @@
+import asyncio
+import os
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+pytest.importorskip('economicsl')
+
+import fixedpoint  # noqa: E402
+import service  # noqa: E402
+from contracts import AssetType  # noqa: E402
+from model import Model, Parameters, get_extent_of_systemic_event  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA = os.path.join(HERE, 'EBA_2018.csv')
+
+SCENARIOS = [
+    dict(INITIAL_SHOCK=0.02, PRICE_IMPACTS=0.01, BANK_LEVERAGE_BUFFER=0.05),
+    dict(INITIAL_SHOCK=0.1, PRICE_IMPACTS=0.01),
+    dict(INITIAL_SHOCK=0.2, PRICE_IMPACTS=0.05, BANK_LEVERAGE_BUFFER=1),
+    dict(INITIAL_SHOCK=0.3, ASSET_TO_SHOCK=AssetType.CORPORATE_BONDS),
+    dict(INITIAL_SHOCK=0, PRICE_IMPACTS=0.01, BANK_LEVERAGE_BUFFER=1,
+         SIMULATION_TIMESTEPS=1000),
+]
+
+
+def run_service(client, **kwargs):
+    # Runs `client(port, svc)` against a service on a free localhost port.
+    async def main():
+        svc, server = await service.serve(port=0, data=DATA, **kwargs)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await client(port, svc)
+        finally:
+            server.close()
+            await server.wait_closed()
+            await svc.stop()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def parameters():
+    saved = dict(vars(Parameters))
+    yield Parameters
+    for name in ('INITIAL_SHOCK', 'PRICE_IMPACTS', 'BANK_LEVERAGE_BUFFER',
+                 'ASSET_TO_SHOCK', 'SIMULATION_TIMESTEPS'):
+        setattr(Parameters, name, saved[name])
+
+
+def test_matches_solver_and_agent_engine(parameters):
+    async def client(port, svc):
+        requests = [dict(s, id=i) for i, s in enumerate(SCENARIOS)]
+        return await service.query(requests, port=port)
+    responses = {r['id']: r for r in run_service(client)}
+
+    model = Model(DATA)
+    names, balance_sheets, prices = model.get_initial_state()
+    # Before the loop changes Parameters, which make_scenario takes its
+    # defaults from.
+    all_params = [service._as_parameters(service.make_scenario(s))
+                  for s in SCENARIOS]
+    for i, params in enumerate(all_params):
+        response = responses[i]
+        result = fixedpoint.solve(balance_sheets, prices, [params],
+                                  max_rounds=params['SIMULATION_TIMESTEPS'])
+        assert response['total_sold'] == result.total_sold[0, -1]
+        assert response['rounds'] == result.rounds[0]
+        assert response['converged'] == result.converged[0]
+
+        # The same answer as the agent engine over SIMULATION_TIMESTEPS.
+        for name in ('INITIAL_SHOCK', 'BANK_LEVERAGE_BUFFER', 'ASSET_TO_SHOCK',
+                     'SIMULATION_TIMESTEPS'):
+            setattr(parameters, name, params[name])
+        parameters.PRICE_IMPACTS = defaultdict(lambda: params['PRICE_IMPACTS'])
+        model.initialize()
+        defaults, total_sold = model.run_simulation()
+        assert response['total_sold'] == pytest.approx(float(total_sold[-1]), abs=1e-9)
+        assert response['eoc'] == pytest.approx(
+            get_extent_of_systemic_event(defaults, len(model.allAgents)), abs=1e-9)
+    # The terminal state of the leverage-targeting case is reached.
+    assert responses[4]['converged']
+
+
+def test_cache_and_shared_solves():
+    async def client(port, svc):
+        scenario = dict(INITIAL_SHOCK=0.15, PRICE_IMPACTS=0.03)
+        concurrent = await service.query(
+            [dict(scenario, id=i) for i in range(20)], port=port)
+        repeated = await service.query([dict(scenario, id='again')], port=port)
+        stats = await service.query([{'stats': True}], port=port)
+        return concurrent, repeated, stats[0]
+    concurrent, repeated, stats = run_service(client, window=0.05)
+    assert len(concurrent) == 20
+    assert len({r['total_sold'] for r in concurrent}) == 1
+    assert repeated[0]['cached'] and repeated[0]['id'] == 'again'
+    assert stats['solved'] == 1
+    assert stats['requests'] == 21
+
+
+def test_invalid_requests():
+    async def client(port, svc):
+        return await service.query([
+            dict(id='nan', INITIAL_SHOCK=float('nan')),
+            dict(id='unknown', NOPE=1),
+            dict(id='asset', ASSET_TO_SHOCK=3),
+            dict(id='pi', PRICE_IMPACTS=1.0),
+            dict(id='steps', SIMULATION_TIMESTEPS=0.5),
+            dict(id='ok', INITIAL_SHOCK=0.1),
+        ], port=port)
+    responses = {r['id']: r for r in run_service(client)}
+    for request_id in ('nan', 'unknown', 'asset', 'pi', 'steps'):
+        assert 'error' in responses[request_id]
+    # The batch loop keeps going.
+    assert 'error' not in responses['ok']
+    assert np.isfinite(responses['ok']['total_sold'])
+
+
+def test_stop_resolves_pending_requests():
+    async def main():
+        _, balance_sheets = Model(DATA).get_initial_state()[:2]
+        svc = service.StressTestService(balance_sheets, np.ones(2), window=60)
+        svc.start()
+        scenario = service.make_scenario(dict(INITIAL_SHOCK=0.1))
+        waiting = asyncio.ensure_future(svc.submit(scenario))
+        await asyncio.sleep(0.05)
+        await svc.stop()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(waiting, 5)
+        assert not svc.pending
+    asyncio.run(main())
+
+
+def test_client_going_away():
+    async def client(port, svc):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'{"INITIAL_SHOCK": 0.25}\n')
+        await writer.drain()
+        writer.close()
+        await asyncio.sleep(0.2)
+        # The service still answers the other clients.
+        return await service.query([dict(id=1, INITIAL_SHOCK=0.25)], port=port)
+    responses = run_service(client)
+    assert responses[0]['id'] == 1 and 'error' not in responses[0]
@@ -0,0 +1,190 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('economicsl')
+
+import batch  # noqa: E402
+import shards  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SPEC = {
+    'grid': {'INITIAL_SHOCK': {'linspace': [0, 0.3, 7]},
+             'PRICE_IMPACTS': [0.01, 0.05]},
+    'replicas': 2,
+    'engine': 'fixedpoint',
+    'data': os.path.join(HERE, 'EBA_2018.csv'),
+}
+
+# A worker that runs one task of its first shard and then either hangs
+# (to be killed while holding the lock) or fails.
+FAULTY_WORKER = """
+import sys, time
+import batch, shards
+mode = sys.argv[2]
+run_tasks = batch.run_tasks
+calls = []
+def faulty_run_tasks(*args, **kwargs):
+    if calls:
+        if mode == 'hang':
+            time.sleep(3600)
+        raise RuntimeError('injected failure')
+    calls.append(1)
+    return run_tasks(*args, **kwargs)
+batch.run_tasks = faulty_run_tasks
+shards.work(sys.argv[1])
+"""
+
+
+def write_spec(tmp_path, **kwargs):
+    path = tmp_path / 'spec.json'
+    path.write_text(json.dumps(dict(SPEC, **kwargs)))
+    return batch.load_spec(str(path))
+
+
+def start(*args):
+    return subprocess.Popen([sys.executable] + list(args), cwd=HERE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def wait_for(path, timeout=60):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        assert time.time() < deadline, path
+        time.sleep(0.05)
+
+
+def test_workers_match_single_node(tmp_path):
+    spec = write_spec(tmp_path)
+    directory = str(tmp_path / 'sweep')
+    shards.plan(spec, directory, 7)
+
+    # A worker killed while holding the lock of shard 0.
+    hung = start('-c', FAULTY_WORKER, directory, 'hang')
+    wait_for(os.path.join(directory, 'shard-0.lock'))
+    time.sleep(0.5)
+    hung.send_signal(signal.SIGKILL)
+    hung.wait()
+    assert os.path.exists(os.path.join(directory, 'shard-0.lock'))
+
+    # A worker that fails in its first shard releases the lock.
+    failed = start('-c', FAULTY_WORKER, directory, 'fail')
+    assert failed.wait(60) != 0
+    assert b'injected failure' in failed.stderr.read()
+
+    workers = [start('shards.py', 'work', directory, '--lease', '1', '--wait')
+               for _ in range(3)]
+    for w in workers:
+        assert w.wait(120) == 0, w.stderr.read()
+    assert not [f for f in os.listdir(directory) if '.lock' in f]
+
+    names, grid, eocs, solds = shards.merge(directory)
+    expected = batch.run_sweep(spec)
+    assert names == expected[0]
+    np.testing.assert_array_equal(grid, expected[1])
+    np.testing.assert_array_equal(eocs, expected[2])
+    np.testing.assert_array_equal(solds, expected[3])
+
+
+def test_plan_validation(tmp_path):
+    spec = write_spec(tmp_path)
+    for n in (0, -1):
+        with pytest.raises(ValueError):
+            shards.plan(spec, str(tmp_path / 'a'), n)
+    shards.plan(spec, str(tmp_path / 'b'), 2)
+    with pytest.raises(ValueError):
+        shards.plan(spec, str(tmp_path / 'b'), 2)
+
+
+def test_merge_checks_spec(tmp_path):
+    spec = write_spec(tmp_path)
+    directory = str(tmp_path / 'sweep')
+    shards.plan(spec, directory, 3)
+    shards.work(directory)
+    shards.merge(directory)
+    path = os.path.join(directory, shards.SPEC_FILE)
+    with open(path) as f:
+        changed = json.load(f)
+    changed['grid']['INITIAL_SHOCK'] = {'linspace': [0, 0.5, 7]}
+    with open(path, 'w') as f:
+        json.dump(changed, f)
+    with pytest.raises(ValueError):
+        shards.merge(directory)
+
+
+def test_claim_gives_back_a_fresh_lock(tmp_path, monkeypatch):
+    # The lock looks stale when checked, but has been claimed again by
+    # another worker by the time it is moved away.
+    directory = str(tmp_path)
+    lock = os.path.join(directory, 'shard-0.lock')
+    with open(lock, 'w') as f:
+        f.write('other')
+    now = time.time()
+    times = iter([now + 100, now])
+    monkeypatch.setattr(shards.time, 'time', lambda: next(times))
+    assert not shards.claim(directory, 0, 'me', lease=10)
+    with open(lock) as f:
+        assert f.read() == 'other'
+    assert os.listdir(directory) == ['shard-0.lock']
+
+
+def test_claim_stale_lock(tmp_path):
+    directory = str(tmp_path)
+    assert shards.claim(directory, 0, 'dead', lease=10)
+    assert not shards.claim(directory, 0, 'me', lease=10)
+    old = time.time() - 100
+    os.utime(os.path.join(directory, 'shard-0.lock'), (old, old))
+    assert shards.claim(directory, 0, 'me', lease=10)
+    shards.release(directory, 0, 'me')
+    assert os.listdir(directory) == []
+
+
+def test_release_keeps_a_reclaimed_lock(tmp_path):
+    # The lock of 'me' has been considered stale and claimed by 'other'.
+    directory = str(tmp_path)
+    assert shards.claim(directory, 0, 'other', lease=10)
+    lock = os.path.join(directory, 'shard-0.lock')
+    old = time.time() - 100
+    os.utime(lock, (old, old))
+    shards.release(directory, 0, 'me')
+    assert os.listdir(directory) == ['shard-0.lock']
+    assert shards._lock_owner(lock) == 'other'
+
+
+def test_heartbeat_leaves_a_reclaimed_lock(tmp_path):
+    spec = write_spec(tmp_path)
+    directory = str(tmp_path / 'sweep')
+    spec = shards.plan(spec, directory, 7)
+    assert shards.claim(directory, 0, 'other', lease=10)
+    lock = os.path.join(directory, 'shard-0.lock')
+    old = time.time() - 100
+    os.utime(lock, (old, old))
+    shards.run_shard(spec, directory, 0, batch.load_models(spec), 'me')
+    assert os.path.getmtime(lock) == pytest.approx(old)
+
+
+def test_datasets_axis(tmp_path):
+    # A second data file, with the first banks of EBA_2018.csv.
+    with open(SPEC['data']) as f:
+        lines = f.read().strip().split('\n')
+    data = tmp_path / 'first_banks.csv'
+    data.write_text('\n'.join(lines[:21]))
+    spec = write_spec(tmp_path, data=[SPEC['data'], str(data)])
+    directory = str(tmp_path / 'sweep')
+    shards.plan(spec, directory, 5)
+    shards.work(directory)
+    output = str(tmp_path / 'out.npz')
+    shards.main(['merge', directory, '-o', output])
+    expected = batch.run_sweep(spec)
+    with np.load(output) as merged:
+        assert list(merged['datasets']) == spec['data']
+        assert merged['eocs'].shape == (2, 14, 2)
+        np.testing.assert_array_equal(merged['eocs'], expected[2])
+        np.testing.assert_array_equal(merged['solds'], expected[3])